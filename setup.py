@@ -18,5 +18,5 @@ setup(
     packages=['teamleader'],
     include_package_data=True,
 
-    install_requires=['requests', 'pycountry']
+    install_requires=['requests', 'pycountry', 'futures; python_version < "3"']
 )
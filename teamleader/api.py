@@ -8,7 +8,10 @@ import pycountry
 import datetime
 import time
 
+from teamleader.concurrency import bounded_map, merge_by_id, prefetch
 from teamleader.exceptions import *
+from teamleader.planner import CallPlanner
+from teamleader.ratelimit import TokenBucket
 
 
 logging.basicConfig(level='ERROR')
@@ -25,26 +28,76 @@ class Teamleader(object):
         '30DEM', '45DEM', '60DEM', '75DEM', '90DEM', '120DEM'
     ]
 
-    def __init__(self, api_group, api_secret):
+    max_selected_customfields = 10
+
+    def __init__(self, api_group, api_secret, dry_run=False, call_budget=None, rate_limiter=None,
+            timeout=None, scheduler=None, priority='interactive', transport=requests):
+        """Setting up a Teamleader API client.
+
+        Args:
+            api_group: string: your Teamleader API group
+            api_secret: string: your Teamleader API secret
+            dry_run: True/False: if set to True, no requests are sent. Calls are recorded in
+                self.planner instead, to estimate the cost of a job. Requests return an empty list.
+            call_budget: integer: maximum number of API calls this instance may make. Calls over
+                the budget raise TeamleaderCallBudgetExceededError before being sent.
+            rate_limiter: TokenBucket every request waits for before being sent. Use a
+                SharedTokenBucket to share the rate limit with other processes on this host.
+            timeout: float: seconds to wait for Teamleader to respond. (default: None, wait forever)
+            scheduler: PriorityScheduler every request waits for before being sent, instead of
+                rate_limiter. Share it between instances to share its rate limiter by priority.
+            priority: string: priority class of the requests of this instance in the scheduler
+                (default: interactive)
+            transport: object with a post method like requests.post, used to send requests, eg.
+                a RecordingTransport or ReplayTransport. (default: requests)
+        """
         log.debug("Initializing Teamleader with group {0} and secret {1}".format(api_group, api_secret))
         self.group = api_group
         self.secret = api_secret
+        self.dry_run = dry_run
+        self.timeout = timeout
+        self.transport = transport
+        self.scheduler = scheduler
+        self.priority = priority
+        self.planner = CallPlanner(call_budget=call_budget)
+
+        if scheduler is not None:
+            if priority not in scheduler.priorities:
+                raise InvalidInputError("Invalid contents of argument priority.")
+            rate_limiter = rate_limiter or scheduler.rate_limiter
+
+        self.rate_limiter = rate_limiter
+        if rate_limiter is not None:
+            self.planner.rate_limit = rate_limiter.rate
 
     def _request(self, endpoint, data=None):
         """Internal method for making a request to a Teamleader endpoint.
         """
-        log.debug("Making a request to the Teamleader API endpoint {0}".format(endpoint))
         data = data or {}
+
+        if self.dry_run:
+            self.planner.record(endpoint, data)
+            return []
+
+        self.planner.charge(endpoint)
+        if self.scheduler is not None:
+            self.scheduler.acquire(self.priority)
+        elif self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        log.debug("Making a request to the Teamleader API endpoint {0}".format(endpoint))
         data['api_group'] = self.group
         data['api_secret'] = self.secret
 
-        r = requests.post(base_url.format(endpoint), data=data)
+        r = self.transport.post(base_url.format(endpoint), data=data, timeout=self.timeout)
         response = r.json()
 
         if r.status_code == requests.codes.unauthorized:
             raise TeamleaderUnauthorizedError(message=response['reason'], api_response=r)
 
         if r.status_code == 505:
+            if self.rate_limiter is not None:
+                self.rate_limiter.drain()
             raise TeamleaderRateLimitExceededError(message=response['reason'], api_response=r)
 
         if r.status_code == requests.codes.bad_request:
@@ -55,6 +108,52 @@ class Teamleader(object):
 
         raise TeamleaderUnknownAPIError(message=response['reason'], api_response=r)
 
+    def _paginate(self, endpoint, data):
+        """Internal method for iterating over all pages of a paginated Teamleader endpoint.
+        """
+        key = self.planner.page_key(endpoint, data)
+
+        if self.dry_run:
+            for pageno in range(self.planner.pages(key)):
+                page_data = {'amount': amount, 'pageno': pageno}
+                page_data.update(data)
+                self._request(endpoint, page_data)
+            return
+
+        there_are_more_pages = True
+        pageno = 0
+        while there_are_more_pages:
+            page_data = {'amount': amount, 'pageno': pageno}
+            page_data.update(data)
+            items = self._request(endpoint, page_data)
+            there_are_more_pages = (len(items) == amount)
+            for item in items:
+                yield item
+            pageno += 1
+
+        self.planner.learn_pages(key, pageno)
+
+    def _paginate_customfields(self, endpoint, data, selected_customfields):
+        """Internal method for iterating over a paginated Teamleader endpoint selecting any
+        number of custom fields.
+
+        Teamleader selects at most max_selected_customfields custom fields per request, so
+        larger selections are split over concurrent scans whose records are merged by ID.
+        """
+        if not selected_customfields:
+            return self._paginate(endpoint, data)
+
+        size = self.max_selected_customfields
+        scans = []
+        for i in range(0, len(selected_customfields), size):
+            scan_data = dict(data)
+            scan_data['selected_customfields'] = ','.join([str(x) for x in selected_customfields[i:i + size]])
+            scans.append(self._paginate(endpoint, scan_data))
+
+        if len(scans) == 1:
+            return scans[0]
+        return merge_by_id([prefetch(scan, amount) for scan in scans])
+
     @staticmethod
     def _validate_type(arg, t):
         if arg and not isinstance(arg, t):
@@ -64,12 +163,13 @@ class Teamleader(object):
 
     @staticmethod
     def _convert_custom_fields(data):
-        for custom_field_id, custom_field_value in data.pop('custom_fields').items():
+        for custom_field_id, custom_field_value in data.pop('custom_fields', {}).items():
             data['custom_field_' + str(custom_field_id)] = custom_field_value
 
     @staticmethod
     def _clean_input_to_dict(data):
-        for key in data.keys():
+        data.pop('self', None)
+        for key in list(data.keys()):
             if data[key] is None:
                 del data[key]
             elif isinstance(data[key], bool):
@@ -189,7 +289,7 @@ class Teamleader(object):
             raise InvalidInputError("Invalid contents of argument date_of_birth.")
 
         # convert data elements that need conversion
-        data['add_tag_by_string'] = ','.join(data.pop('tags'))
+        data['add_tag_by_string'] = ','.join(data.pop('tags', []))
         self._convert_custom_fields(data)
 
         if date_of_birth is not None:
@@ -263,11 +363,9 @@ class Teamleader(object):
             raise InvalidInputError("Invalid contents of argument date_of_birth.")
 
         # convert data elements that need conversion
-        data['add_tag_by_string'] = ','.join(data.pop('tags'))
-        data['remove_tag_by_string'] = ','.join(data.pop('del_tags'))
-
-        for custom_field_id, custom_field_value in data.pop('custom_fields').items():
-            data['custom_field_' + str(custom_field_id)] = custom_field_value
+        data['add_tag_by_string'] = ','.join(data.pop('tags', []))
+        data['remove_tag_by_string'] = ','.join(data.pop('del_tags', []))
+        self._convert_custom_fields(data)
 
         if date_of_birth is not None:
             data['dob'] = time.mktime(data.pop('date_of_birth').timetuple())
@@ -316,8 +414,9 @@ class Teamleader(object):
                 have the tag.
             segment_id: integer: The ID of a segment created for contacts. Teamleader will
                 only return contacts that have been filtered out by the segment settings.
-            selected_customfields: list of the IDs of the custom fields you wish to select
-                (max 10).
+            selected_customfields: list of the IDs of the custom fields you wish to select.
+                Teamleader selects at most 10 per request: longer lists are fetched in
+                concurrent scans of 10, merged by ID.
 
         Returns:
             Iterator over the contacts found.
@@ -333,19 +432,9 @@ class Teamleader(object):
         if segment_id is not None:
             data['segment_id'] = segment_id
         selected_customfields = self._validate_type(selected_customfields, list)
-        if selected_customfields:
-            data['selected_customfields'] = ','.join([str(x) for x in selected_customfields])
 
-        there_are_more_pages = True
-        pageno = 0
-        while there_are_more_pages:
-            page_data = {'amount': amount, 'pageno': pageno}
-            page_data.update(data)
-            contacts = self._request('getContacts', page_data)
-            there_are_more_pages = (len(contacts) == amount)
-            for contact in contacts:
-                yield contact
-            pageno += 1
+        for contact in self._paginate_customfields('getContacts', data, selected_customfields):
+            yield contact
 
     def get_contact(self, contact_id):
         """Fetching contact information.
@@ -437,8 +526,7 @@ class Teamleader(object):
         if 'tags' in data:
             data['add_tag_by_string'] = ','.join(data.pop('tags'))
 
-        for custom_field_id, custom_field_value in data.pop('custom_fields').items():
-            data['custom_field_' + str(custom_field_id)] = custom_field_value
+        self._convert_custom_fields(data)
 
         data['automerge_by_name'] = int(automerge_by_name)
         data['automerge_by_email'] = int(automerge_by_email)
@@ -504,11 +592,9 @@ class Teamleader(object):
                 raise InvalidInputError("Invalid contents of argument payment_term.")
 
         # convert data elements that need conversion
-        data['add_tag_by_string'] = ','.join(data.pop('tags'))
-        data['remove_tag_by_string'] = ','.join(data.pop('del_tags'))
-
-        for custom_field_id, custom_field_value in data.pop('custom_fields').items():
-            data['custom_field_' + str(custom_field_id)] = custom_field_value
+        data['add_tag_by_string'] = ','.join(data.pop('tags', []))
+        data['remove_tag_by_string'] = ','.join(data.pop('del_tags', []))
+        self._convert_custom_fields(data)
 
         self._request('updateCompany', data)
 
@@ -533,8 +619,9 @@ class Teamleader(object):
                 have the tag.
             segment_id: integer: The ID of a segment created for companies. Teamleader will
                 only return companies that have been filtered out by the segment settings.
-            selected_customfields: list of the IDs of the custom fields you wish to select
-                (max 10).
+            selected_customfields: list of the IDs of the custom fields you wish to select.
+                Teamleader selects at most 10 per request: longer lists are fetched in
+                concurrent scans of 10, merged by ID.
 
         Returns:
             Iterator over the companies found.
@@ -550,19 +637,9 @@ class Teamleader(object):
         if segment_id is not None:
             data['segment_id'] = segment_id
         selected_customfields = self._validate_type(selected_customfields, list)
-        if selected_customfields:
-            data['selected_customfields'] = ','.join([str(x) for x in selected_customfields])
 
-        there_are_more_pages = True
-        pageno = 0
-        while there_are_more_pages:
-            page_data = {'amount': amount, 'pageno': pageno}
-            page_data.update(data)
-            companies = self._request('getCompanies', page_data)
-            there_are_more_pages = (len(companies) == amount)
-            for company in companies:
-                yield company
-            pageno += 1
+        for company in self._paginate_customfields('getCompanies', data, selected_customfields):
+            yield company
 
     def get_company(self, company_id):
         """Fetching company information.
@@ -671,16 +748,16 @@ class Teamleader(object):
             data['amount_' + str(i)] = line['amount']
             data['vat_' + str(i)] = line['vat']
 
-            if 'product_id' in data:
+            if 'product_id' in line:
                 data['product_id_' + str(i)] = line['product_id']
-            if 'account' in data:
+            if 'account' in line:
                 data['account_' + str(i)] = line['account']
-            if 'subtitle' in data:
+            if 'subtitle' in line:
                 data['subtitle_' + str(i)] = line['subtitle']
 
             i += 1
 
-        del(data['invoice_lines'])
+        data.pop('invoice_lines', None)
 
         if date is not None:
             data['date'] = data.pop('date').strftime('%d/%m/%Y')
@@ -703,17 +780,73 @@ class Teamleader(object):
             'status': 'paid' if paid else 'not_paid'
         })
 
-    def book_draft_invoice(self):
-        pass
+    def book_draft_invoice(self, invoice_id):
+        """Booking a draft invoice, giving it an invoice number.
 
-    def update_invoice(self):
-        pass
+        Args:
+            invoice_id: integer: ID of the draft invoice
+        """
 
-    def update_invoice_comment(self):
-        pass
+        self._request('bookDraftInvoice', {'invoice_id': invoice_id})
 
-    def delete_invoice(self):
-        pass
+    def update_invoice(self, invoice_id, for_attention_of=None, payment_term=None, layout_id=None,
+            date=None, po_number=None, direct_debit=None, custom_fields=None):
+        """Updating invoice information.
+
+        Args:
+            invoice_id: integer: ID of the invoice
+            for_attention_of: string
+            payment_term: 0D / 7D / 10D / 15D / 21D / 30D / 45D / 60D / 90D / 30DEM / 60DEM / 90DEM
+            layout_id: ID of the custom layout you wish to use for this invoice
+            date: datetime.date object: the date of the invoice
+            po_number: string
+            direct_debit: True/False: set to True to enable direct debit
+            custom_fields: dict with keys the IDs of your custom fields and values the value to be set
+        """
+
+        # argument validation
+        if payment_term is not None:
+            if payment_term not in self._valid_payment_terms:
+                raise InvalidInputError("Invalid contents of argument payment_term.")
+
+        if date is not None and type(date) != datetime.date:
+            raise InvalidInputError("Invalid contents of argument date.")
+
+        custom_fields = self._validate_type(custom_fields, dict)
+
+        # convert data elements that need conversion
+        data = self._clean_input_to_dict({
+            'invoice_id': invoice_id,
+            'for_attention_of': for_attention_of,
+            'payment_term': payment_term,
+            'layout_id': layout_id,
+            'date': date.strftime('%d/%m/%Y') if date is not None else None,
+            'po_number': po_number,
+            'direct_debit': direct_debit,
+            'custom_fields': custom_fields,
+        })
+        self._convert_custom_fields(data)
+
+        self._request('updateInvoice', data)
+
+    def update_invoice_comment(self, invoice_id, comment):
+        """Updating the comment of an invoice.
+
+        Args:
+            invoice_id: integer: ID of the invoice
+            comment: string
+        """
+
+        self._request('updateInvoiceComment', {'invoice_id': invoice_id, 'comment': comment})
+
+    def delete_invoice(self, invoice_id):
+        """Deleting an invoice.
+
+        Args:
+            invoice_id: integer: ID of the invoice
+        """
+
+        self._request('deleteInvoice', {'invoice_id': invoice_id})
 
     def get_invoices(self, since, until):
         """Getting all invoices in a time period.
@@ -728,11 +861,103 @@ class Teamleader(object):
             'date_to': until.strftime('%d/%m/%Y')
         })
 
-    def get_creditnotes(self):
-        pass
+    def get_creditnotes(self, since, until):
+        """Getting all credit notes in a time period.
 
-    def get_invoice(self):
-        pass
+        Args:
+            since: date: Start date of the period you are requesting credit notes for
+            until: date: End date of the period you are requesting credit notes for
 
-    def get_creditnote(self):
-        pass
+        """
+        return self._request('getCreditnotes', data={
+            'date_from': since.strftime('%d/%m/%Y'),
+            'date_to': until.strftime('%d/%m/%Y')
+        })
+
+    def get_invoice(self, invoice_id):
+        """Fetching invoice information.
+
+        Args:
+            invoice_id: integer: ID of the invoice
+
+        Returns:
+            Dictionary with invoice details.
+        """
+
+        return self._request('getInvoice', {'invoice_id': invoice_id})
+
+    def get_creditnote(self, creditnote_id):
+        """Fetching credit note information.
+
+        Args:
+            creditnote_id: integer: ID of the credit note
+
+        Returns:
+            Dictionary with credit note details.
+        """
+
+        return self._request('getCreditnote', {'creditnote_id': creditnote_id})
+
+    def get_invoice_documents(self, since, until, creditnotes=True, workers=4, window=None, retries=5):
+        """Getting the details of all invoices and credit notes in a time period.
+
+        Details are fetched concurrently, with at most window documents in flight, so memory
+        stays bounded for large periods. Every request waits for the rate limiter of this
+        instance, or for a default TokenBucket if it has none, and requests refused because the
+        rate limit was exceeded are retried.
+
+        In dry-run mode only the listing calls are planned: the number of detail calls depends on
+        the number of documents, and is reported in the unknown_page_counts of the plan.
+
+        Args:
+            since: date: Start date of the period you are requesting documents for
+            until: date: End date of the period you are requesting documents for
+            creditnotes: True/False: set to False to skip credit notes. (default: True)
+            workers: integer: number of concurrent requests
+            window: integer: maximum number of documents in flight. (default: twice the number
+                of workers)
+            retries: integer: maximum number of retries per document after exceeding the rate limit
+
+        Returns:
+            Iterator over (document type, details) tuples, where document type is invoice or
+            creditnote. Invoices come first, in the order of get_invoices.
+        """
+
+        if self.dry_run:
+            period = {'date_from': since.strftime('%d/%m/%Y'), 'date_to': until.strftime('%d/%m/%Y')}
+            self.planner.unknown_page_counts.add(self.planner.page_key('getInvoice', period))
+            if creditnotes:
+                self.planner.unknown_page_counts.add(self.planner.page_key('getCreditnote', period))
+
+        limiter = None
+        if self.rate_limiter is None and self.scheduler is None:
+            limiter = TokenBucket()
+
+        def documents():
+            for invoice in self.get_invoices(since, until):
+                yield 'invoice', invoice['id']
+            if creditnotes:
+                for creditnote in self.get_creditnotes(since, until):
+                    yield 'creditnote', creditnote['id']
+
+        def hydrate(document):
+            document_type, document_id = document
+            get = self.get_invoice if document_type == 'invoice' else self.get_creditnote
+
+            attempt = 0
+            while True:
+                if limiter is not None:
+                    limiter.acquire()
+                try:
+                    return document_type, get(document_id)
+                except TeamleaderRateLimitExceededError:
+                    if attempt >= retries:
+                        raise
+                    if limiter is not None:
+                        limiter.drain()
+                    log.debug("Rate limit exceeded fetching {0} {1}, retrying".format(document_type, document_id))
+                    time.sleep(2 ** attempt)
+                    attempt += 1
+
+        for document in bounded_map(hydrate, documents(), workers, window):
+            yield document
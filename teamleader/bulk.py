@@ -0,0 +1,152 @@
+"""
+Teamleader bulk invoice operations
+"""
+
+import logging
+import time
+
+import requests
+
+from teamleader.concurrency import bounded_map
+from teamleader.exceptions import TeamleaderRateLimitExceededError, TeamleaderUnknownAPIError
+
+
+log = logging.getLogger('teamleader.bulk')
+
+
+class InvoiceResult(object):
+    """Outcome of the operations on one invoice in an InvoiceBatch.
+
+    Attributes:
+        invoice_id: integer: ID of the invoice
+        booked: True/False: whether the draft was booked in this batch
+        paid: True/False/None: payment status set in this batch, None if it was not set
+        attempts: integer: number of requests made for this invoice
+        error: exception that made the operations on this invoice fail, or None
+    """
+
+    def __init__(self, invoice_id):
+        self.invoice_id = invoice_id
+        self.booked = False
+        self.paid = None
+        self.attempts = 0
+        self.error = None
+
+    def __repr__(self):
+        return 'InvoiceResult(invoice_id={0!r}, booked={1!r}, paid={2!r}, attempts={3!r}, error={4!r})'.format(
+            self.invoice_id, self.booked, self.paid, self.attempts, self.error)
+
+
+class InvoiceBatch(object):
+    """Booking draft invoices and updating payment statuses in bulk.
+
+    Every step is run over all invoices with bounded concurrency. Invoices that failed with a
+    transient error (rate limit exceeded, connection problem, server error) are retried after
+    the step, in their original order. An invoice that fails a step is skipped for later steps.
+
+    Booking is only retried blindly when Teamleader certainly did not book the draft (rate limit
+    exceeded, timeout while connecting). After an ambiguous failure (read timeout, dropped
+    connection, server error) the invoice is fetched first, and only booked again if it is still
+    a draft. Setting the payment status is idempotent and is always retried.
+
+    Booking gives drafts their invoice number. With more than one worker, numbers follow the
+    order in which bookings complete; use one worker to number invoices in their given order.
+
+    Args:
+        api: Teamleader instance
+        workers: integer: number of concurrent requests
+        retries: integer: maximum number of retries per invoice and step
+        backoff: float: seconds to wait before the first retry round, doubled for every next one
+        is_booked: function taking the details of an invoice as returned by get_invoice and
+            returning whether it is booked. (default: the invoice has an invoice number)
+    """
+
+    _rejected = (TeamleaderRateLimitExceededError, requests.exceptions.ConnectTimeout)
+    _ambiguous = (TeamleaderUnknownAPIError, requests.exceptions.RequestException, ValueError)
+    _transient = _rejected + _ambiguous
+
+    def __init__(self, api, workers=4, retries=3, backoff=1.0, is_booked=None):
+        self.api = api
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.is_booked = is_booked or (lambda invoice: bool(invoice.get('invoice_nr')))
+
+    def _ambiguously_failed(self, result):
+        return isinstance(result.error, self._ambiguous) and not isinstance(result.error, self._rejected)
+
+    def _booked_after_failure(self, result):
+        """Checking whether an invoice whose booking failed ambiguously was booked after all."""
+        if not self._ambiguously_failed(result):
+            return False
+
+        error = result.error
+        try:
+            invoice = self.api.get_invoice(result.invoice_id)
+        except Exception:
+            # whether the draft was booked is still unknown
+            raise error
+
+        if self.is_booked(invoice):
+            result.booked = True
+            result.error = None
+        return result.booked
+
+    def _step(self, results, operation):
+        def attempt(result):
+            result.attempts += 1
+            try:
+                operation(result)
+            except self._transient as e:
+                result.error = e
+                return result
+            except Exception as e:
+                result.error = e
+                return None
+            result.error = None
+            return None
+
+        pending = [result for result in results if result.error is None]
+        for retry in range(self.retries + 1):
+            if retry:
+                log.debug("Retrying {0} invoices".format(len(pending)))
+                time.sleep(self.backoff * 2 ** (retry - 1))
+            pending = [result for result in bounded_map(attempt, pending, self.workers) if result is not None]
+            if not pending:
+                break
+
+    def run(self, invoice_ids, book=True, paid=None):
+        """Running the batch.
+
+        Args:
+            invoice_ids: list of IDs of the invoices
+            book: True/False: set to True to book the invoices, which must be drafts
+            paid: True/False/None: payment status to set, None to leave it as is
+
+        Returns:
+            List of InvoiceResult, in the order of invoice_ids.
+        """
+
+        results = [InvoiceResult(invoice_id) for invoice_id in invoice_ids]
+
+        if book:
+            def book_draft(result):
+                if self._booked_after_failure(result):
+                    return
+                self.api.book_draft_invoice(result.invoice_id)
+                result.booked = True
+            self._step(results, book_draft)
+
+            for result in results:
+                try:
+                    self._booked_after_failure(result)
+                except Exception:
+                    log.debug("Could not check whether invoice {0} was booked".format(result.invoice_id))
+
+        if paid is not None:
+            def set_payment_status(result):
+                self.api.update_invoice_payment_status(result.invoice_id, paid)
+                result.paid = paid
+            self._step(results, set_payment_status)
+
+        return results
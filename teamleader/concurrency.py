@@ -0,0 +1,130 @@
+"""
+Teamleader concurrency helpers
+"""
+
+import collections
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def bounded_map(func, iterable, workers=4, window=None):
+    """Applying func to every item of iterable in a thread pool.
+
+    At most window items are in flight at any time, so memory stays bounded however long
+    iterable is. Results are yielded in the order of iterable. Exceptions raised by func are
+    raised when their result is reached.
+
+    Args:
+        func: function taking one item
+        iterable: items to process
+        workers: integer: number of threads
+        window: integer: maximum number of items in flight. (default: twice the number of workers)
+
+    Returns:
+        Iterator over the results.
+    """
+
+    window = window or 2 * workers
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prefetch(iterable, size=100):
+    """Iterating over iterable in a background thread.
+
+    At most size items are buffered ahead of the consumer. Exceptions raised while iterating
+    are raised to the consumer. The thread stops when the returned iterator is closed.
+
+    Args:
+        iterable: items to fetch
+        size: integer: maximum number of buffered items
+
+    Returns:
+        Iterator over the items of iterable.
+    """
+
+    buffer = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(entry):
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as e:
+            put((False, e))
+        else:
+            put((False, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+
+    try:
+        thread.start()
+        while True:
+            has_item, item = buffer.get()
+            if not has_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def merge_by_id(iterables, key='id'):
+    """Merging records with the same ID from several iterables into one record.
+
+    The iterables are consumed in turn, so records are held only until they have been seen in
+    every iterable. When the iterables list their records in the same order, only a handful of
+    records is in memory at any time. Records missing from some iterables are yielded at the end.
+
+    Args:
+        iterables: iterables over dicts
+        key: name of the ID field
+
+    Returns:
+        Iterator over the merged records.
+    """
+
+    iterators = [iter(iterable) for iterable in iterables]
+    pending = collections.OrderedDict()
+
+    while iterators:
+        for iterator in list(iterators):
+            try:
+                record = next(iterator)
+            except StopIteration:
+                iterators.remove(iterator)
+                continue
+
+            merged, seen = pending.pop(record[key], ({}, 0))
+            merged.update(record)
+            if seen + 1 == len(iterables):
+                yield merged
+            else:
+                pending[record[key]] = (merged, seen + 1)
+
+    for merged, _ in pending.values():
+        yield merged
@@ -27,3 +27,11 @@ class TeamleaderBadRequestError(TeamleaderAPIError):
 
 class TeamleaderUnknownAPIError(TeamleaderAPIError):
     pass
+
+
+class TeamleaderCallBudgetExceededError(TeamleaderError):
+    pass
+
+
+class TeamleaderAmbiguousWriteError(TeamleaderError):
+    pass
@@ -0,0 +1,303 @@
+"""
+Teamleader idempotent writes
+"""
+
+import datetime
+import hashlib
+import inspect
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import requests
+
+from teamleader.exceptions import *
+
+
+log = logging.getLogger('teamleader.idempotency')
+
+
+class IdempotencyLedger(object):
+    """Local record of the outcome of writes, keyed by idempotency key.
+
+    A write is pending from the moment it is claimed until its outcome is known. A pending entry
+    that survives a crash marks a write that may or may not have been committed by Teamleader.
+    Claims are atomic, so of all callers writing with the same key only one sends the write.
+
+    Args:
+        path: path of the SQLite database. (default: in memory, for the lifetime of the ledger)
+    """
+
+    def __init__(self, path=':memory:'):
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._in_flight_changed = threading.Condition()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS writes ('
+                             'key TEXT PRIMARY KEY, method TEXT, status TEXT, result TEXT, updated REAL)')
+
+    def get(self, key):
+        """Fetching the entry of a write.
+
+        Returns:
+            Tuple of status (pending/done) and result, or None if the write is unknown.
+        """
+
+        with self._lock:
+            row = self._db.execute('SELECT status, result FROM writes WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _set_in_flight(self, key, in_flight):
+        with self._in_flight_changed:
+            if in_flight:
+                self._in_flight.add(key)
+            else:
+                self._in_flight.discard(key)
+            self._in_flight_changed.notify_all()
+
+    def claim(self, key, method):
+        """Claiming a write before sending it.
+
+        Returns:
+            True if the write was unknown and is now pending for this caller, False if another
+            caller already has an entry for it.
+        """
+
+        with self._lock, self._db:
+            try:
+                self._db.execute('INSERT INTO writes VALUES (?, ?, ?, ?, ?)',
+                                 (key, method, 'pending', json.dumps(None), time.time()))
+            except sqlite3.IntegrityError:
+                return False
+        self._set_in_flight(key, True)
+        return True
+
+    def take_over(self, key, stale_after):
+        """Claiming a pending write that has not been touched for stale_after seconds, eg. one
+        left behind by a crash.
+
+        Returns:
+            True if the write is now pending for this caller.
+        """
+
+        now = time.time()
+        with self._lock, self._db:
+            taken = self._db.execute('UPDATE writes SET updated = ? WHERE key = ? AND status = ? AND updated < ?',
+                                     (now, key, 'pending', now - stale_after)).rowcount == 1
+        if taken:
+            self._set_in_flight(key, True)
+        return taken
+
+    def wait(self, key, timeout=None):
+        """Waiting until a write claimed by another thread of this process has an outcome.
+
+        Returns:
+            The entry of the write, as returned by get.
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._in_flight_changed:
+            while key in self._in_flight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._in_flight_changed.wait(remaining)
+        return self.get(key)
+
+    def complete(self, key, method, result):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?)',
+                             (key, method, 'done', json.dumps(result), time.time()))
+        self._set_in_flight(key, False)
+
+    def forget(self, key):
+        """Removing a write that is known not to have been committed."""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM writes WHERE key = ?', (key,))
+        self._set_in_flight(key, False)
+
+    def release(self, key):
+        """Giving up a claim on a write whose outcome is unknown, leaving it pending."""
+        self._set_in_flight(key, False)
+
+
+def find_contact(api, call):
+    """Looking up a contact added by add_contact, by email address and name."""
+    if not call['email']:
+        raise TeamleaderAmbiguousWriteError("Cannot look up a contact without email address.")
+
+    for contact in api.get_contacts(query=call['email']):
+        if ((contact.get('email') or '').lower() == call['email'].lower() and
+                contact.get('forename') == call['forename'] and contact.get('surname') == call['surname']):
+            return contact['id']
+
+
+def find_company(api, call):
+    """Looking up a company added by add_company, by name and VAT code."""
+    if not call['name']:
+        raise TeamleaderAmbiguousWriteError("Cannot look up a company without name.")
+
+    for company in api.get_companies(query=call['name']):
+        if company.get('name') == call['name'] and (call['vat_code'] is None or company.get('vat_code') == call['vat_code']):
+            return company['id']
+
+
+class IdempotentWriter(object):
+    """Retrying writes safely by recording their outcome in an idempotency ledger.
+
+    Every write gets an idempotency key, supplied by the caller as idempotency_key or derived
+    from the run_id, the method and its arguments. Arguments Teamleader defaults to today, like
+    the date of an invoice, are derived with today's date, so a recurring write is not mistaken
+    for last period's. A write that is done in the ledger is not sent again. Writes through a
+    dry-run client bypass the ledger, so planning a job never marks its writes as done.
+
+    Failures where Teamleader certainly did not commit the write (rate limit exceeded, timeout
+    while connecting) are retried. After an ambiguous failure (read timeout, refused or dropped
+    connection, server error) the write is looked up first and only retried if it was not found.
+    Writes without a lookup raise TeamleaderAmbiguousWriteError instead and stay pending in the
+    ledger.
+
+    Concurrent writes with the same key are sent once. Callers in the same process wait for the
+    outcome of the first one. A write pending elsewhere, eg. in another process or left behind by
+    a crash, is looked up, and only sent again once it has been pending for stale_after seconds.
+
+    Args:
+        api: Teamleader instance
+        ledger: IdempotencyLedger
+        retries: integer: maximum number of retries per write
+        backoff: float: seconds to wait before the first retry, doubled for every next one
+        lookups: dict with keys the names of write methods and values functions taking the
+            Teamleader instance and a dict of the call arguments, returning the ID of the
+            written object or None. Contacts and companies are looked up by default.
+        run_id: string: identifier of the job, eg. a batch ID. Derived keys are scoped to it, so
+            identical writes in different jobs are all sent. (default: None, derived keys are
+            shared by all jobs using the ledger)
+        stale_after: float: seconds after which a write pending elsewhere may be sent again
+        wait_timeout: float: seconds to wait for the outcome of the same write in another thread
+    """
+
+    _rejected = (TeamleaderRateLimitExceededError, requests.exceptions.ConnectTimeout)
+    _ambiguous = (TeamleaderUnknownAPIError, requests.exceptions.RequestException, ValueError)
+    _defaults_to_today = {'add_invoice': ('date',)}
+
+    def __init__(self, api, ledger=None, retries=3, backoff=1.0, lookups=None, run_id=None,
+            stale_after=60.0, wait_timeout=300.0):
+        self.api = api
+        self.stale_after = stale_after
+        self.wait_timeout = wait_timeout
+        self.run_id = run_id
+        self.ledger = ledger or IdempotencyLedger()
+        self.retries = retries
+        self.backoff = backoff
+        self.lookups = {'add_contact': find_contact, 'add_company': find_company}
+        self.lookups.update(lookups or {})
+
+    def derive_key(self, method, call):
+        call = dict(call)
+        for argument in self._defaults_to_today.get(method, ()):
+            if call.get(argument) is None:
+                call[argument] = datetime.date.today()
+
+        payload = json.dumps([self.run_id, method, call], sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _lookup(self, key, method, call):
+        if method not in self.lookups:
+            raise TeamleaderAmbiguousWriteError("Outcome of {0} with key {1} is unknown.".format(method, key))
+        return self.lookups[method](self.api, call)
+
+    def _write(self, method, args, kwargs):
+        idempotency_key = kwargs.pop('idempotency_key', None)
+        func = getattr(self.api, method)
+        if self.api.dry_run:
+            return func(*args, **kwargs)
+
+        call = inspect.getcallargs(func, *args, **kwargs)
+        call.pop('self', None)
+        key = idempotency_key or self.derive_key(method, call)
+
+        while not self.ledger.claim(key, method):
+            entry = self.ledger.wait(key, self.wait_timeout)
+            if entry is None:
+                # the other caller's write definitely failed: claim it again
+                continue
+
+            status, result = entry
+            if status == 'done':
+                return result
+
+            log.debug("Looking up pending write {0} with key {1}".format(method, key))
+            result = self._lookup(key, method, call)
+            if result is not None:
+                self.ledger.complete(key, method, result)
+                return result
+
+            if not self.ledger.take_over(key, self.stale_after):
+                raise TeamleaderAmbiguousWriteError("{0} with key {1} is in flight elsewhere.".format(method, key))
+            break
+
+        attempt = 0
+        while True:
+            try:
+                result = func(*args, **kwargs)
+            except self._rejected:
+                if attempt >= self.retries:
+                    self.ledger.forget(key)
+                    raise
+            except self._ambiguous:
+                try:
+                    result = self._lookup(key, method, call)
+                except Exception:
+                    self.ledger.release(key)
+                    raise
+                if result is not None:
+                    self.ledger.complete(key, method, result)
+                    return result
+                if attempt >= self.retries:
+                    self.ledger.forget(key)
+                    raise
+            except Exception:
+                self.ledger.forget(key)
+                raise
+            else:
+                self.ledger.complete(key, method, result)
+                return result
+
+            log.debug("Retrying {0} with key {1}".format(method, key))
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def add_contact(self, *args, **kwargs):
+        """Adding a contact to Teamleader at most once. See Teamleader.add_contact.
+
+        Args:
+            idempotency_key: string: key identifying this write. (default: derived from the
+                arguments)
+        """
+
+        return self._write('add_contact', args, kwargs)
+
+    def add_company(self, *args, **kwargs):
+        """Adding a company to Teamleader at most once. See Teamleader.add_company.
+
+        Args:
+            idempotency_key: string: key identifying this write. (default: derived from the
+                arguments)
+        """
+
+        return self._write('add_company', args, kwargs)
+
+    def add_invoice(self, *args, **kwargs):
+        """Adding an invoice to Teamleader at most once. See Teamleader.add_invoice.
+
+        Args:
+            idempotency_key: string: key identifying this write. (default: derived from the
+                arguments)
+        """
+
+        return self._write('add_invoice', args, kwargs)
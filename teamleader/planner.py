@@ -0,0 +1,104 @@
+"""
+Teamleader API call planner
+"""
+
+import logging
+import threading
+
+from teamleader.exceptions import TeamleaderCallBudgetExceededError
+from teamleader.ratelimit import DEFAULT_RATE_LIMIT
+
+
+log = logging.getLogger('teamleader.planner')
+
+
+class CallPlanner(object):
+    """Keeps track of the API calls a Teamleader instance makes or plans to make.
+
+    In dry-run mode every call is recorded instead of being sent, so the cost of a job can be
+    estimated up front. In normal mode every call is counted against the optional call budget.
+
+    Args:
+        rate_limit: float: number of calls per second used to estimate the runtime of a plan
+        call_budget: integer: maximum number of calls this job is allowed to make
+        page_counts: dict mapping page keys (see page_key) to the number of pages a paginated
+            scan took the last time it ran. Page counts learned during real runs are stored here
+            too, so the dict can be persisted and reused for planning later jobs.
+    """
+
+    def __init__(self, rate_limit=DEFAULT_RATE_LIMIT, call_budget=None, page_counts=None):
+        self.rate_limit = rate_limit
+        self.call_budget = call_budget
+        self.page_counts = dict(page_counts or {})
+        self.calls = []
+        self.calls_made = 0
+        self.unknown_page_counts = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def page_key(endpoint, data):
+        """Key identifying a paginated scan: the endpoint with its filters, without paging."""
+        filters = ['{0}={1}'.format(k, data[k]) for k in sorted(data) if k not in ('amount', 'pageno')]
+        return endpoint + '?' + '&'.join(filters)
+
+    def record(self, endpoint, data=None):
+        """Record a planned call instead of making it."""
+        log.debug("Planning a request to the Teamleader API endpoint {0}".format(endpoint))
+        with self._lock:
+            self.calls.append((endpoint, dict(data or {})))
+
+    def charge(self, endpoint):
+        """Count a real call against the budget, refusing it when the budget is used up."""
+        with self._lock:
+            if self.call_budget is not None and self.calls_made >= self.call_budget:
+                raise TeamleaderCallBudgetExceededError(
+                    "Call budget of {0} exhausted before calling {1}.".format(self.call_budget, endpoint))
+            self.calls_made += 1
+
+    def pages(self, key):
+        """Number of pages to plan for a paginated scan. Unknown scans are planned as one page."""
+        if key not in self.page_counts:
+            self.unknown_page_counts.add(key)
+        return self.page_counts.get(key, 1)
+
+    def learn_pages(self, key, pages):
+        self.page_counts[key] = pages
+
+    @property
+    def estimated_calls(self):
+        return len(self.calls)
+
+    @property
+    def estimated_runtime(self):
+        """Estimated runtime of the planned calls in seconds at the configured rate limit."""
+        return self.estimated_calls / float(self.rate_limit)
+
+    @property
+    def within_budget(self):
+        return self.call_budget is None or self.calls_made + self.estimated_calls <= self.call_budget
+
+    def summary(self):
+        """Summary of the plan.
+
+        Returns:
+            Dictionary with the estimated number of calls, the estimated runtime in seconds,
+            the planned calls per endpoint, whether the plan fits in the remaining budget and
+            the paginated scans whose page count had to be guessed.
+        """
+
+        per_endpoint = {}
+        for endpoint, _ in self.calls:
+            per_endpoint[endpoint] = per_endpoint.get(endpoint, 0) + 1
+
+        return {
+            'calls': self.estimated_calls,
+            'runtime': self.estimated_runtime,
+            'endpoints': per_endpoint,
+            'within_budget': self.within_budget,
+            'unknown_page_counts': sorted(self.unknown_page_counts),
+        }
+
+    def reset(self):
+        """Forget the planned calls, keeping the learned page counts and the budget."""
+        self.calls = []
+        self.unknown_page_counts = set()
@@ -0,0 +1,128 @@
+"""
+Teamleader API rate limiters
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from teamleader.exceptions import TeamleaderError
+
+
+# Teamleader allows 25 API calls per 5 seconds per account. A token bucket lets up to
+# capacity + 5 * rate calls through in any 5 seconds, so the defaults stay within that limit.
+DEFAULT_RATE_LIMIT = 4.0
+DEFAULT_BURST = 5
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter shared by all threads of a process.
+
+    At most capacity + rate * 5 calls are let through in any 5 seconds: keep that at or under
+    Teamleader's limit of 25.
+
+    Args:
+        rate: float: number of calls per second
+        capacity: integer: maximum number of calls in a burst
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._state = (float(capacity), time.time())
+
+    def _update(self, func):
+        """Replace the (tokens, updated) state by func(tokens, updated) and return its result."""
+        with self._lock:
+            tokens, updated, result = func(*self._state)
+            self._state = (tokens, updated)
+        return result
+
+    def _refill(self, tokens, updated):
+        now = time.time()
+        return min(self.capacity, tokens + (now - updated) * self.rate), now
+
+    def try_acquire(self, reserve=0):
+        """Taking a token if one is available.
+
+        Args:
+            reserve: integer: number of tokens that must stay in the bucket after taking one
+
+        Returns:
+            0 if a token was taken, otherwise the number of seconds to wait before trying again.
+        """
+
+        def take(tokens, updated):
+            tokens, updated = self._refill(tokens, updated)
+            if tokens >= 1 + reserve:
+                return tokens - 1, updated, 0
+            return tokens, updated, (1 + reserve - tokens) / self.rate
+
+        return self._update(take)
+
+    def acquire(self):
+        """Blocking until a token is taken."""
+        wait = self.try_acquire()
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    def drain(self):
+        """Emptying the bucket, eg. after Teamleader reported the rate limit was exceeded."""
+        self._update(lambda tokens, updated: (0.0, time.time(), None))
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket rate limiter shared by all processes on this host using the same API group.
+
+    The bucket state lives in a small file protected by an exclusive file lock, so every
+    Teamleader instance in every process that uses the same file draws from the same budget.
+    Requires a POSIX platform.
+
+    Args:
+        api_group: string: your Teamleader API group, used to name the state file
+        rate: float: number of calls per second
+        capacity: integer: maximum number of calls in a burst
+        path: path of the state file. (default: a file in the temporary directory, named after
+            the API group)
+    """
+
+    def __init__(self, api_group, rate=DEFAULT_RATE_LIMIT, capacity=DEFAULT_BURST, path=None):
+        if fcntl is None:
+            raise TeamleaderError("SharedTokenBucket requires a platform with fcntl.")
+
+        super(SharedTokenBucket, self).__init__(rate, capacity)
+
+        if path is None:
+            digest = hashlib.sha1(str(api_group).encode('utf-8')).hexdigest()[:16]
+            path = os.path.join(tempfile.gettempdir(), 'teamleader-ratelimit-' + digest)
+        self.path = path
+
+    def _update(self, func):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            raw = os.read(fd, 64).split()
+            if len(raw) == 2:
+                tokens, updated = float(raw[0]), float(raw[1])
+            else:
+                tokens, updated = float(self.capacity), time.time()
+
+            tokens, updated, result = func(tokens, updated)
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, '{0!r} {1!r}'.format(tokens, updated).encode('ascii'))
+        finally:
+            # closing the file releases the lock
+            os.close(fd)
+        return result
@@ -0,0 +1,233 @@
+"""
+Teamleader declarative reconciliation
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+
+from teamleader.concurrency import bounded_map
+from teamleader.exceptions import InvalidInputError
+
+
+log = logging.getLogger('teamleader.reconcile')
+
+
+def _normalize(value):
+    """Value as stored in a snapshot: dates become ISO 8601 strings, so they survive JSON."""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+class Snapshot(object):
+    """Local copy of the current Teamleader state of contacts or companies.
+
+    Every record is a dict of field values, with the optional keys tags (list of all tags of
+    the record) and custom_fields (dict with keys the IDs of custom fields and values their value).
+    Dates are stored as ISO 8601 strings.
+
+    Args:
+        path: path of the JSON file the snapshot is loaded from and saved to. (default: None,
+            the snapshot is kept in memory only)
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.records = json.load(f)
+
+    def save(self):
+        if self.path is None:
+            return
+
+        # the rename happens under the lock too, so concurrent saves never share a temporary file
+        tmp_path = self.path + '.tmp'
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.records, f)
+            getattr(os, 'replace', os.rename)(tmp_path, self.path)
+
+    def get(self, record_id):
+        with self._lock:
+            return self.records.get(str(record_id), {})
+
+    def set(self, record_id, record):
+        record = dict((key, _normalize(value)) for key, value in record.items() if key != 'id')
+        if 'custom_fields' in record:
+            record['custom_fields'] = dict((str(k), _normalize(v)) for k, v in record['custom_fields'].items())
+        with self._lock:
+            self.records[str(record_id)] = record
+
+    def apply(self, record_id, changes):
+        """Applying changes as computed by diff to a record."""
+        record = self.get(record_id)
+        record = dict(record, custom_fields=dict(record.get('custom_fields', {})))
+
+        tags = set(record.get('tags', []))
+        tags.update(changes.get('tags', []))
+        tags.difference_update(changes.get('del_tags', []))
+
+        for key, value in changes.items():
+            if key == 'custom_fields':
+                record['custom_fields'].update(value)
+            elif key not in ('tags', 'del_tags'):
+                record[key] = value
+
+        record['tags'] = sorted(tags)
+        self.set(record_id, record)
+
+    def load(self, api, object_type='contacts', selected_customfields=None):
+        """Filling the snapshot with the current state of all contacts or companies in Teamleader.
+
+        Fields are stored as returned by get_contacts or get_companies. Custom field values,
+        returned as cf_value_<ID>, are stored in custom_fields, and comma separated tags in tags.
+
+        Args:
+            api: Teamleader instance
+            object_type: contacts/companies
+            selected_customfields: list of the IDs of the custom fields to load
+        """
+
+        if object_type not in Reconciler._updates:
+            raise InvalidInputError("Invalid contents of argument object_type.")
+
+        scan = api.get_contacts if object_type == 'contacts' else api.get_companies
+        for record in scan(selected_customfields=selected_customfields):
+            record = dict(record)
+            custom_fields = {}
+            for key in list(record):
+                if key.startswith('cf_value_'):
+                    custom_fields[key[len('cf_value_'):]] = record.pop(key)
+            record['custom_fields'] = custom_fields
+
+            tags = record.get('tags')
+            if tags is not None and not isinstance(tags, list):
+                record['tags'] = [tag.strip() for tag in tags.split(',') if tag.strip()]
+
+            self.set(record['id'], record)
+
+
+def diff(current, desired):
+    """Computing the minimal update turning the current state of a record into the desired one.
+
+    Fields missing from the desired record are left alone. Tags are compared as sets.
+
+    Args:
+        current: dict: current record, as held in a Snapshot
+        desired: dict: desired record
+
+    Returns:
+        Dict of update arguments (fields, tags, del_tags, custom_fields), empty if the
+        record is up to date.
+    """
+
+    changes = {}
+
+    for key, value in desired.items():
+        if key in ('id', 'tags', 'custom_fields'):
+            continue
+        if current.get(key) != _normalize(value):
+            changes[key] = value
+
+    if 'tags' in desired:
+        current_tags = set(current.get('tags', []))
+        desired_tags = set(desired['tags'])
+        if desired_tags - current_tags:
+            changes['tags'] = sorted(desired_tags - current_tags)
+        if current_tags - desired_tags:
+            changes['del_tags'] = sorted(current_tags - desired_tags)
+
+    current_custom_fields = current.get('custom_fields', {})
+    custom_fields = {}
+    for custom_field_id, value in desired.get('custom_fields', {}).items():
+        if current_custom_fields.get(str(custom_field_id)) != _normalize(value):
+            custom_fields[custom_field_id] = value
+    if custom_fields:
+        changes['custom_fields'] = custom_fields
+
+    return changes
+
+
+class Reconciler(object):
+    """Pushing desired contacts or companies to Teamleader, updating only what changed.
+
+    Desired records are compared against the snapshot. Only changed fields, tag deltas and
+    changed custom fields are sent, and only for records that changed. The snapshot is updated
+    after every successful update, and saved every save_every updates and when a reconcile ends,
+    so a crashed run only resends the updates since the last save. With a dry-run client the
+    updates are only planned and the snapshot is left untouched.
+
+    Args:
+        api: Teamleader instance
+        snapshot: Snapshot of the current state of the records
+        object_type: contacts/companies
+        workers: integer: number of concurrent updates
+        track_changes: True/False: if set to True, all changes are logged and visible to users
+            in the web-interface
+        save_every: integer: number of updates after which the snapshot is saved
+    """
+
+    _updates = {
+        'contacts': ('update_contact', 'contact_id'),
+        'companies': ('update_company', 'company_id'),
+    }
+
+    def __init__(self, api, snapshot, object_type='contacts', workers=4, track_changes=True, save_every=50):
+        if object_type not in self._updates:
+            raise InvalidInputError("Invalid contents of argument object_type.")
+
+        self.api = api
+        self.snapshot = snapshot
+        self.object_type = object_type
+        self.workers = workers
+        self.track_changes = track_changes
+        self.save_every = save_every
+        self._updated = 0
+        self._lock = threading.Lock()
+
+    def _reconcile(self, desired):
+        changes = diff(self.snapshot.get(desired['id']), desired)
+        if changes:
+            method, id_argument = self._updates[self.object_type]
+            log.debug("Updating {0} {1}: {2}".format(self.object_type, desired['id'], sorted(changes)))
+
+            kwargs = dict(changes)
+            kwargs[id_argument] = desired['id']
+            getattr(self.api, method)(track_changes=self.track_changes, **kwargs)
+            if self.api.dry_run:
+                return desired['id'], changes
+
+            self.snapshot.apply(desired['id'], changes)
+
+            with self._lock:
+                self._updated += 1
+                save = self._updated % self.save_every == 0
+            if save:
+                self.snapshot.save()
+        return desired['id'], changes
+
+    def reconcile(self, records):
+        """Reconciling desired records with Teamleader.
+
+        Args:
+            records: iterable of dicts, each containing the id of the record and its desired
+                fields, and optionally its complete list of tags and a custom_fields dict
+
+        Returns:
+            Iterator over (ID, changes) tuples, in the order of records. Changes is empty for
+            records that were up to date.
+        """
+
+        try:
+            for result in bounded_map(self._reconcile, records, self.workers):
+                yield result
+        finally:
+            if not self.api.dry_run:
+                self.snapshot.save()
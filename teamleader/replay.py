@@ -0,0 +1,124 @@
+"""
+Teamleader record and replay transports
+"""
+
+import collections
+import gzip
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from teamleader.exceptions import TeamleaderError
+
+
+log = logging.getLogger('teamleader.replay')
+
+scrubbed_fields = ('api_group', 'api_secret')
+
+
+def _scrub(data):
+    return dict((k, v) for k, v in (data or {}).items() if k not in scrubbed_fields)
+
+
+def _key(url, data):
+    return url, json.dumps(data, sort_keys=True, default=str)
+
+
+class ReplayResponse(object):
+    """Response served by a ReplayTransport, with the parts of requests.Response the client uses."""
+
+    def __init__(self, status_code, text, elapsed=0.0):
+        self.status_code = status_code
+        self.text = text
+        self.elapsed = elapsed
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class RecordingTransport(object):
+    """Transport recording every exchange with Teamleader.
+
+    Exchanges are written as gzipped JSON lines holding the URL, the request data without the
+    API group and secret, the status code, the response body and the response time.
+
+    Args:
+        path: path of the recording
+        transport: transport making the actual requests. (default: requests)
+    """
+
+    def __init__(self, path, transport=requests):
+        self.path = path
+        self.transport = transport
+        self._file = gzip.open(path, 'wb')
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, **kwargs):
+        started = time.time()
+        r = self.transport.post(url, data=data, **kwargs)
+        elapsed = time.time() - started
+
+        exchange = {
+            'url': url,
+            'data': _scrub(data),
+            'status_code': r.status_code,
+            'text': r.text,
+            'elapsed': round(elapsed, 4),
+        }
+        line = json.dumps(exchange, sort_keys=True, default=str) + '\n'
+        with self._lock:
+            self._file.write(line.encode('utf-8'))
+
+        return r
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayTransport(object):
+    """Transport serving exchanges from a recording made by RecordingTransport, without network.
+
+    Requests are matched on URL and data, ignoring the API group and secret. Identical requests
+    are served their recorded responses in order; the last one is repeated once they run out.
+
+    Args:
+        path: path of the recording
+        latency_scale: float: factor applied to the recorded response times. Use 1 to replay at
+            recorded latencies and 0 to respond immediately. (default: 1)
+    """
+
+    def __init__(self, path, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self.requests = 0
+        self._exchanges = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                exchange = json.loads(line.decode('utf-8'))
+                self._exchanges[_key(exchange['url'], exchange['data'])].append(exchange)
+
+    def post(self, url, data=None, **kwargs):
+        key = _key(url, _scrub(data))
+
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                raise TeamleaderError("No recorded exchange for {0} with data {1}".format(*key))
+            exchange = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+            self.requests += 1
+
+        if self.latency_scale:
+            time.sleep(exchange['elapsed'] * self.latency_scale)
+
+        return ReplayResponse(exchange['status_code'], exchange['text'], exchange['elapsed'])
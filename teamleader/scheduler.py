@@ -0,0 +1,94 @@
+"""
+Teamleader API request scheduler
+"""
+
+import collections
+import threading
+import time
+
+from teamleader.exceptions import InvalidInputError
+from teamleader.ratelimit import TokenBucket
+
+
+class PriorityScheduler(object):
+    """Sharing one rate limiter between classes of requests with different priorities.
+
+    Requests wait in one queue per class. A token is always handed to the oldest request of
+    the highest priority class that is waiting. Lower priority classes can also be made to
+    leave tokens in the bucket, so a burst of higher priority requests does not have to wait.
+
+    Give every Teamleader instance the same scheduler and a priority, eg. one instance with
+    priority interactive for the web application and one with priority batch for syncs.
+
+    Args:
+        rate_limiter: TokenBucket or SharedTokenBucket. (default: a new TokenBucket)
+        priorities: list of class names, highest priority first
+        reserves: dict with keys class names and values the number of tokens that must stay in
+            the bucket for a request of that class to take one. (default: batch keeps 2 tokens)
+    """
+
+    def __init__(self, rate_limiter=None, priorities=('interactive', 'batch'), reserves=None):
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.priorities = list(priorities)
+        self.reserves = {'batch': 2} if reserves is None else dict(reserves)
+        if any(reserve >= self.rate_limiter.capacity for reserve in self.reserves.values()):
+            raise InvalidInputError("Reserves must be smaller than the rate limiter capacity.")
+
+        self._condition = threading.Condition()
+        self._queues = dict((priority, collections.deque()) for priority in self.priorities)
+        self._stats = dict((priority, {'requests': 0, 'wait': 0.0, 'max_wait': 0.0, 'max_queue_depth': 0})
+                           for priority in self.priorities)
+
+    def _head(self):
+        for priority in self.priorities:
+            if self._queues[priority]:
+                return self._queues[priority][0]
+
+    def acquire(self, priority):
+        """Blocking until a request of the given class may be sent."""
+        if priority not in self._queues:
+            raise InvalidInputError("Invalid contents of argument priority.")
+
+        ticket = object()
+        queue = self._queues[priority]
+        stats = self._stats[priority]
+        enqueued = time.time()
+
+        with self._condition:
+            queue.append(ticket)
+            stats['max_queue_depth'] = max(stats['max_queue_depth'], len(queue))
+
+            try:
+                while True:
+                    timeout = None
+                    if self._head() is ticket:
+                        timeout = self.rate_limiter.try_acquire(self.reserves.get(priority, 0))
+                        if not timeout:
+                            break
+                    self._condition.wait(timeout)
+            finally:
+                queue.remove(ticket)
+                self._condition.notify_all()
+
+            wait = time.time() - enqueued
+            stats['requests'] += 1
+            stats['wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+
+    def stats(self):
+        """Getting latency and queue statistics.
+
+        Returns:
+            Dictionary with keys the class names and values dicts with the number of requests,
+            the mean and maximum time in seconds they waited, and the current and maximum
+            queue depth.
+        """
+
+        with self._condition:
+            return dict((priority, {
+                'requests': stats['requests'],
+                'mean_wait': stats['wait'] / stats['requests'] if stats['requests'] else 0.0,
+                'max_wait': stats['max_wait'],
+                'queue_depth': len(self._queues[priority]),
+                'max_queue_depth': stats['max_queue_depth'],
+            }) for priority, stats in self._stats.items())
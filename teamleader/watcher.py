@@ -0,0 +1,172 @@
+"""
+Teamleader change watcher
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import time
+
+import requests
+
+from teamleader.exceptions import InvalidInputError, TeamleaderRateLimitExceededError, TeamleaderUnknownAPIError
+
+
+log = logging.getLogger('teamleader.watcher')
+
+ChangeEvent = collections.namedtuple('ChangeEvent', ['type', 'object_type', 'record'])
+
+
+class ChangeWatcher(object):
+    """Polls Teamleader for contacts or companies that were added or modified since the last poll.
+
+    Every change is emitted as a ChangeEvent with type created or updated. Records are created
+    when their ID has not been seen by this watcher before. The high-water mark and the known IDs
+    are persisted after every poll, so a restarted watcher picks up where it left off. Events are
+    emitted before the state is saved: after a crash, changes may be reported twice, never lost.
+
+    The poll interval adapts to the change rate: it halves after a poll that found changes and
+    grows by backoff after a quiet one. A quiet poll costs a single API call. A poll that fails
+    with a transient error (rate limit exceeded, connection problem, server error) is logged and
+    treated as a quiet one, so the watcher keeps running and backs off.
+
+    Args:
+        api: Teamleader instance
+        object_type: contacts/companies
+        callbacks: list of functions, each called with every ChangeEvent
+        queue: object with a put method (eg. a Queue) that receives every ChangeEvent
+        state_path: path of the JSON file holding the persisted state
+        modified_since: integer: Unix timestamp to start from if there is no persisted state.
+            (default: None, the first poll reports every existing record as created)
+        known_ids: IDs to consider existing if there is no persisted state
+        min_interval: float: shortest poll interval in seconds
+        max_interval: float: longest poll interval in seconds
+        backoff: float: factor by which the interval grows after a quiet poll
+        overlap: integer: seconds the high-water mark is moved back to cover clock skew between
+            this host and Teamleader. Records returned again unchanged because of the overlap
+            are not reported again.
+    """
+
+    _transient = (TeamleaderRateLimitExceededError, TeamleaderUnknownAPIError,
+                  requests.exceptions.RequestException, ValueError)
+
+    _scans = {
+        'contacts': 'get_contacts',
+        'companies': 'get_companies',
+    }
+
+    def __init__(self, api, object_type='contacts', callbacks=None, queue=None, state_path=None,
+            modified_since=None, known_ids=None, min_interval=5.0, max_interval=300.0,
+            backoff=1.5, overlap=5):
+        if object_type not in self._scans:
+            raise InvalidInputError("Invalid contents of argument object_type.")
+
+        self.api = api
+        self.object_type = object_type
+        self.callbacks = list(callbacks or [])
+        self.queue = queue
+        self.state_path = state_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.overlap = overlap
+        self.interval = min_interval
+
+        self.modified_since = modified_since
+        self.known_ids = set(known_ids or [])
+        self.recent = {}
+        self._load()
+
+    def _load(self):
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return
+
+        with open(self.state_path) as f:
+            state = json.load(f)
+
+        self.modified_since = state['modified_since']
+        self.known_ids = set(state['known_ids'])
+        self.recent = state.get('recent', {})
+
+    def _save(self):
+        if self.state_path is None:
+            return
+
+        state = {'modified_since': self.modified_since, 'known_ids': sorted(self.known_ids), 'recent': self.recent}
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        getattr(os, 'replace', os.rename)(tmp_path, self.state_path)
+
+    def _emit(self, event):
+        for callback in self.callbacks:
+            callback(event)
+        if self.queue is not None:
+            self.queue.put(event)
+
+    @staticmethod
+    def _fingerprint(record):
+        return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+    def _adapt(self, changes):
+        if changes:
+            self.interval = max(self.min_interval, self.interval / 2.0)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def poll(self):
+        """Fetching and emitting all changes since the high-water mark.
+
+        Returns:
+            Number of events emitted.
+        """
+
+        started = int(time.time())
+        scan = getattr(self.api, self._scans[self.object_type])
+
+        modified_since = None
+        if self.modified_since is not None:
+            modified_since = self.modified_since - self.overlap
+
+        # fingerprints of the records returned by this poll, to recognise them in the next overlap
+        recent = {}
+        changes = 0
+        for record in scan(modified_since=modified_since):
+            fingerprint = self._fingerprint(record)
+            recent[str(record['id'])] = fingerprint
+            if self.recent.get(str(record['id'])) == fingerprint:
+                continue
+
+            event_type = 'updated' if record['id'] in self.known_ids else 'created'
+            self.known_ids.add(record['id'])
+            self._emit(ChangeEvent(event_type, self.object_type, record))
+            changes += 1
+
+        self.modified_since = started
+        self.recent = recent
+        self._save()
+        self._adapt(changes)
+
+        log.debug("Polled {0} {1} changes, next poll in {2:.1f}s".format(changes, self.object_type, self.interval))
+        return changes
+
+    def run(self, stop=None):
+        """Polling until stop is set.
+
+        Args:
+            stop: threading.Event: set it to stop the watcher. (default: None, run forever)
+        """
+
+        while stop is None or not stop.is_set():
+            try:
+                self.poll()
+            except self._transient:
+                self._adapt(0)
+                log.warning("Polling {0} failed, next poll in {1:.1f}s".format(self.object_type, self.interval),
+                            exc_info=True)
+            if stop is None:
+                time.sleep(self.interval)
+            else:
+                stop.wait(self.interval)
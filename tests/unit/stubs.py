@@ -0,0 +1,63 @@
+"""
+Stub transport for unit tests
+"""
+
+import json
+import threading
+
+from teamleader.api import Teamleader
+from teamleader.replay import ReplayResponse
+
+
+class StubTransport(object):
+    """Transport answering requests without network, recording every request it gets.
+
+    Args:
+        responses: dict with keys endpoint names (eg. addContact) and values either the response
+            body, a ReplayResponse, or a function taking the request data and returning one of
+            those. Functions may raise to simulate transport errors. Other endpoints answer null.
+    """
+
+    def __init__(self, responses=None):
+        self.responses = dict(responses or {})
+        self.posts = []
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, timeout=None):
+        endpoint = url.rsplit('/', 1)[-1][:-len('.php')]
+        data = dict(data or {})
+        with self._lock:
+            self.posts.append((endpoint, data))
+
+        response = self.responses.get(endpoint)
+        if callable(response):
+            response = response(data)
+        if isinstance(response, ReplayResponse):
+            return response
+        return ReplayResponse(200, json.dumps(response))
+
+    def endpoints(self):
+        return [endpoint for endpoint, _ in self.posts]
+
+
+def outcomes(*results):
+    """Response function answering with results in turn, raising those that are exceptions."""
+    results = list(results)
+
+    def respond(data):
+        result = results.pop(0) if len(results) > 1 else results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return respond
+
+
+def rate_limited():
+    return ReplayResponse(505, json.dumps({'reason': 'Rate limit exceeded'}))
+
+
+def stub_client(responses=None, **kwargs):
+    """Teamleader client sending its requests to a new StubTransport."""
+    transport = StubTransport(responses)
+    return Teamleader('group', 'secret', transport=transport, **kwargs), transport
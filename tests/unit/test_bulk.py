@@ -0,0 +1,86 @@
+import datetime
+
+import requests
+
+from teamleader.api import Teamleader
+from teamleader.bulk import InvoiceBatch
+from teamleader.exceptions import TeamleaderBadRequestError, TeamleaderRateLimitExceededError
+
+
+class FakeAPI(object):
+
+    def __init__(self, failures, booked=()):
+        self.failures = failures
+        self.booked = set(booked)
+        self.calls = []
+
+    def _call(self, method, invoice_id):
+        self.calls.append((method, invoice_id))
+        failures = self.failures.get((method, invoice_id))
+        if failures:
+            raise failures.pop(0)
+
+    def book_draft_invoice(self, invoice_id):
+        self._call('book', invoice_id)
+        self.booked.add(invoice_id)
+
+    def get_invoice(self, invoice_id):
+        self._call('get', invoice_id)
+        return {'invoice_nr': 'I1' if invoice_id in self.booked else None}
+
+    def update_invoice_payment_status(self, invoice_id, paid=True):
+        self._call('paid', invoice_id)
+
+
+def test_invoice_batch():
+    api = FakeAPI({
+        ('book', 2): [TeamleaderRateLimitExceededError('limit', None)],
+        ('book', 3): [TeamleaderBadRequestError('bad', None)],
+        ('paid', 4): [TeamleaderRateLimitExceededError('limit', None)] * 3,
+    })
+
+    results = InvoiceBatch(api, workers=2, retries=2, backoff=0).run([1, 2, 3, 4], paid=True)
+
+    assert [r.invoice_id for r in results] == [1, 2, 3, 4]
+    assert [r.booked for r in results] == [True, True, False, True]
+    assert [r.paid for r in results] == [True, True, None, None]
+    assert [r.attempts for r in results] == [2, 3, 1, 4]
+    assert isinstance(results[2].error, TeamleaderBadRequestError)
+    assert isinstance(results[3].error, TeamleaderRateLimitExceededError)
+    assert ('paid', 3) not in api.calls
+
+
+def test_invoice_batch_checks_ambiguous_bookings():
+    class CommittingAPI(FakeAPI):
+        def book_draft_invoice(self, invoice_id):
+            FakeAPI.book_draft_invoice(self, invoice_id)
+            if invoice_id == 1 and ('book', 1) not in self.failures:
+                self.failures[('book', 1)] = []
+                raise requests.exceptions.ReadTimeout()
+
+    api = CommittingAPI({
+        ('book', 2): [requests.exceptions.ReadTimeout()],
+        ('get', 2): [TeamleaderRateLimitExceededError('limit', None)],
+    })
+
+    results = InvoiceBatch(api, retries=3, backoff=0).run([1, 2])
+
+    assert [r.booked for r in results] == [True, True]
+    assert [r.error for r in results] == [None, None]
+    assert api.calls.count(('book', 1)) == 1
+    assert api.calls.count(('book', 2)) == 2
+
+
+def test_update_invoice(monkeypatch):
+    requests = []
+    api = Teamleader('group', 'secret')
+    monkeypatch.setattr(api, '_request', lambda endpoint, data: requests.append((endpoint, data)))
+
+    api.update_invoice(1, date=datetime.date(2016, 1, 31), direct_debit=True, custom_fields={2: 'x'})
+
+    assert requests == [('updateInvoice', {
+        'invoice_id': 1,
+        'date': '31/01/2016',
+        'direct_debit': 1,
+        'custom_field_2': 'x',
+    })]
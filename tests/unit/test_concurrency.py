@@ -0,0 +1,120 @@
+import datetime
+import time
+
+import pytest
+
+from stubs import outcomes, rate_limited, stub_client
+from teamleader.api import Teamleader
+from teamleader.concurrency import bounded_map, merge_by_id, prefetch
+
+
+def test_bounded_map_keeps_order_and_window():
+    pulled = []
+
+    def items():
+        for x in range(50):
+            pulled.append(x)
+            yield x
+
+    results = []
+    for result in bounded_map(lambda x: x * x, items(), workers=3, window=4):
+        results.append(result)
+        assert len(pulled) - len(results) < 4
+
+    assert results == [x * x for x in range(50)]
+
+
+def test_bounded_map_raises():
+    def fail(x):
+        raise ValueError(x)
+
+    with pytest.raises(ValueError):
+        list(bounded_map(fail, range(3)))
+
+
+def test_get_invoice_documents(monkeypatch):
+    responses = {
+        'getInvoices': [{'id': 1}, {'id': 2}],
+        'getCreditnotes': [{'id': 3}],
+    }
+
+    def request(endpoint, data):
+        if endpoint in responses:
+            return responses[endpoint]
+        return {'endpoint': endpoint, 'data': data}
+
+    api = Teamleader('group', 'secret')
+    monkeypatch.setattr(api, '_request', request)
+
+    day = datetime.date(2016, 1, 1)
+    assert list(api.get_invoice_documents(day, day, workers=2)) == [
+        ('invoice', {'endpoint': 'getInvoice', 'data': {'invoice_id': 1}}),
+        ('invoice', {'endpoint': 'getInvoice', 'data': {'invoice_id': 2}}),
+        ('creditnote', {'endpoint': 'getCreditnote', 'data': {'creditnote_id': 3}}),
+    ]
+
+
+def test_prefetch():
+    assert list(prefetch(range(10), size=2)) == list(range(10))
+
+    def fail():
+        yield 1
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        list(prefetch(fail()))
+
+
+def test_merge_by_id():
+    first = [{'id': 1, 'a': 1}, {'id': 2, 'a': 2}, {'id': 3, 'a': 3}]
+    second = [{'id': 2, 'b': 2}, {'id': 1, 'b': 1}]
+
+    assert list(merge_by_id([first, second])) == [
+        {'id': 2, 'a': 2, 'b': 2},
+        {'id': 1, 'a': 1, 'b': 1},
+        {'id': 3, 'a': 3},
+    ]
+
+
+def test_get_contacts_splits_selected_customfields(monkeypatch):
+    def request(endpoint, data):
+        if data['pageno']:
+            return []
+        contact = {'id': 1}
+        for field_id in data['selected_customfields'].split(','):
+            contact['cf_value_' + field_id] = field_id
+        return [contact]
+
+    api = Teamleader('group', 'secret')
+    monkeypatch.setattr(api, '_request', request)
+
+    contacts = list(api.get_contacts(selected_customfields=list(range(25))))
+
+    assert len(contacts) == 1
+    assert len(contacts[0]) == 26
+    assert len(api.planner.page_counts) == 3
+
+
+def test_get_invoice_documents_retries_rate_limited_details(monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    api, transport = stub_client({
+        'getInvoices': [{'id': 1}],
+        'getCreditnotes': [],
+        'getInvoice': outcomes(rate_limited(), {'id': 1, 'total': 10}),
+    })
+
+    assert list(api.get_invoice_documents(datetime.date(2016, 1, 1), datetime.date(2016, 1, 31))) == [
+        ('invoice', {'id': 1, 'total': 10}),
+    ]
+    assert sorted(transport.endpoints()) == ['getCreditnotes', 'getInvoice', 'getInvoice', 'getInvoices']
+
+
+def test_get_invoice_documents_dry_run_reports_unknown_detail_calls():
+    api, _ = stub_client(dry_run=True)
+    day = datetime.date(2016, 1, 1)
+
+    assert list(api.get_invoice_documents(day, day)) == []
+    assert api.planner.summary()['unknown_page_counts'] == [
+        'getCreditnote?date_from=01/01/2016&date_to=01/01/2016',
+        'getInvoice?date_from=01/01/2016&date_to=01/01/2016',
+    ]
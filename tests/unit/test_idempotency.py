@@ -0,0 +1,130 @@
+import datetime
+import threading
+import time
+
+import pytest
+import requests
+
+from stubs import outcomes, rate_limited, stub_client
+from teamleader.exceptions import TeamleaderAmbiguousWriteError
+from teamleader.idempotency import IdempotencyLedger, IdempotentWriter
+
+
+def test_done_writes_are_not_repeated():
+    api, transport = stub_client({'addContact': 1})
+    writer = IdempotentWriter(api)
+
+    assert writer.add_contact('John', 'Doe', 'john@example.com') == 1
+    assert writer.add_contact('John', 'Doe', email='john@example.com') == 1
+    assert transport.endpoints() == ['addContact']
+
+
+def test_rejected_writes_are_retried():
+    api, transport = stub_client({'addContact': outcomes(rate_limited(), 2)})
+    writer = IdempotentWriter(api, backoff=0)
+
+    assert writer.add_contact('John', 'Doe', 'john@example.com', idempotency_key='john') == 2
+    assert writer.ledger.get('john') == ('done', 2)
+    assert transport.endpoints() == ['addContact', 'addContact']
+
+
+def test_ambiguous_writes_are_looked_up():
+    contacts = []
+
+    def commit_then_time_out(data):
+        contacts.append({'id': 42, 'forename': data['forename'], 'surname': data['surname'], 'email': data['email']})
+        raise requests.exceptions.ReadTimeout()
+
+    api, transport = stub_client({'addContact': commit_then_time_out, 'getContacts': contacts})
+    writer = IdempotentWriter(api, backoff=0)
+
+    assert writer.add_contact('John', 'Doe', 'john@example.com') == 42
+    assert transport.endpoints() == ['addContact', 'getContacts']
+
+
+def test_ambiguous_writes_without_lookup_stay_pending(tmpdir):
+    api, _ = stub_client({'addInvoice': outcomes(requests.exceptions.ReadTimeout())})
+    ledger = IdempotencyLedger(str(tmpdir.join('ledger.db')))
+    writer = IdempotentWriter(api, ledger, backoff=0)
+
+    with pytest.raises(TeamleaderAmbiguousWriteError):
+        writer.add_invoice(1, contact_id=2, idempotency_key='invoice')
+
+    assert IdempotencyLedger(str(tmpdir.join('ledger.db'))).get('invoice') == ('pending', None)
+
+
+def test_derived_keys():
+    api, _ = stub_client()
+    writer = IdempotentWriter(api)
+    call = {'sys_department_id': 1, 'contact_id': 2, 'date': None}
+
+    assert writer.derive_key('add_invoice', call) == writer.derive_key('add_invoice', dict(call, date=datetime.date.today()))
+    assert writer.derive_key('add_invoice', call) != writer.derive_key('add_invoice', dict(call, date=datetime.date(2000, 1, 1)))
+    assert writer.derive_key('add_invoice', call) != IdempotentWriter(api, run_id='next').derive_key('add_invoice', call)
+
+
+def test_writes_through_client():
+    api, transport = stub_client({'addContact': 7, 'addCompany': 7, 'addInvoice': 7})
+    writer = IdempotentWriter(api)
+
+    assert writer.add_contact('John', 'Doe', 'john@example.com') == 7
+    assert writer.add_company('Acme') == 7
+    assert writer.add_invoice(1, contact_id=2, invoice_lines=[
+        {'description': 'Work', 'price': 10, 'amount': 1, 'vat': '21', 'product_id': 3}]) == 7
+    assert writer.add_contact('John', 'Doe', 'john@example.com') == 7
+
+    assert transport.endpoints() == ['addContact', 'addCompany', 'addInvoice']
+    assert transport.posts[2][1]['product_id_1'] == 3
+
+
+def test_dry_runs_bypass_the_ledger():
+    ledger = IdempotencyLedger()
+    dry_api, dry_transport = stub_client(dry_run=True)
+    api, transport = stub_client({'addContact': 7})
+
+    assert IdempotentWriter(dry_api, ledger).add_contact('John', 'Doe', 'john@example.com') == []
+    assert IdempotentWriter(api, ledger).add_contact('John', 'Doe', 'john@example.com') == 7
+
+    assert dry_api.planner.estimated_calls == 1
+    assert dry_transport.posts == []
+    assert transport.endpoints() == ['addContact']
+
+
+def test_concurrent_writes_are_sent_once():
+    def slow_add(data):
+        time.sleep(0.05)
+        return 7
+
+    api, transport = stub_client({'addContact': slow_add})
+    writer = IdempotentWriter(api)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(writer.add_contact('a', 'b', 'c'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [7] * 5
+    assert transport.endpoints() == ['addContact']
+
+
+def test_writes_pending_elsewhere_are_not_sent(tmpdir):
+    path = str(tmpdir.join('ledger.db'))
+    IdempotencyLedger(path).claim('john', 'add_contact')
+    api, transport = stub_client({'addContact': 7, 'getContacts': []})
+
+    with pytest.raises(TeamleaderAmbiguousWriteError):
+        IdempotentWriter(api, IdempotencyLedger(path)).add_contact('John', 'Doe', 'john@example.com', idempotency_key='john')
+    assert transport.endpoints() == ['getContacts']
+
+    writer = IdempotentWriter(api, IdempotencyLedger(path), stale_after=0)
+    assert writer.add_contact('John', 'Doe', 'john@example.com', idempotency_key='john') == 7
+
+
+def test_contacts_without_email_are_not_looked_up():
+    api, transport = stub_client({'addContact': outcomes(requests.exceptions.ReadTimeout())})
+
+    with pytest.raises(TeamleaderAmbiguousWriteError):
+        IdempotentWriter(api).add_contact('John', 'Doe', '')
+    assert transport.endpoints() == ['addContact']
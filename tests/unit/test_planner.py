@@ -0,0 +1,51 @@
+import pytest
+
+from teamleader.api import Teamleader, amount
+from teamleader.exceptions import TeamleaderCallBudgetExceededError
+from teamleader.planner import CallPlanner
+
+
+def test_dry_run_records_calls():
+    api = Teamleader('group', 'secret', dry_run=True)
+
+    assert api.get_users() == []
+    assert list(api.get_contacts(query='foo')) == []
+
+    assert api.planner.calls == [
+        ('getUsers', {'show_inactive_users': 0}),
+        ('getContacts', {'amount': amount, 'pageno': 0, 'searchby': 'foo'}),
+    ]
+    assert api.planner.summary()['unknown_page_counts'] == ['getContacts?searchby=foo']
+
+
+def test_dry_run_uses_page_counts():
+    api = Teamleader('group', 'secret', dry_run=True)
+    api.planner = CallPlanner(rate_limit=2, call_budget=3, page_counts={'getCompanies?': 4})
+
+    list(api.get_companies())
+
+    summary = api.planner.summary()
+    assert summary['calls'] == 4
+    assert summary['runtime'] == 2
+    assert summary['endpoints'] == {'getCompanies': 4}
+    assert not summary['within_budget']
+    assert summary['unknown_page_counts'] == []
+
+
+def test_paginate_learns_page_counts(monkeypatch):
+    api = Teamleader('group', 'secret')
+    pages = [[{'id': i} for i in range(amount)], [{'id': amount}]]
+    monkeypatch.setattr(api, '_request', lambda endpoint, data: pages[data['pageno']])
+
+    assert len(list(api.get_contacts())) == amount + 1
+    assert api.planner.page_counts == {'getContacts?': 2}
+
+
+def test_call_budget():
+    planner = CallPlanner(call_budget=1)
+    planner.charge('getUsers')
+
+    with pytest.raises(TeamleaderCallBudgetExceededError):
+        planner.charge('getUsers')
+
+    assert planner.calls_made == 1
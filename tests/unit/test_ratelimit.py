@@ -0,0 +1,46 @@
+import time
+
+from teamleader.ratelimit import SharedTokenBucket, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, capacity=2)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire(reserve=1) > 0
+    assert bucket.try_acquire() == 0
+    assert 0 < bucket.try_acquire() <= 1
+
+    bucket.drain()
+    assert bucket.try_acquire() > 0.9
+
+
+def test_shared_token_bucket(tmpdir):
+    path = str(tmpdir.join('bucket'))
+    first = SharedTokenBucket('group', rate=1, capacity=2, path=path)
+    second = SharedTokenBucket('group', rate=1, capacity=2, path=path)
+
+    assert first.try_acquire() == 0
+    assert second.try_acquire() == 0
+    assert first.try_acquire() > 0
+    assert second.try_acquire() > 0
+
+
+def test_shared_token_bucket_path_per_group():
+    assert SharedTokenBucket('group').path == SharedTokenBucket('group').path
+    assert SharedTokenBucket('group').path != SharedTokenBucket('other').path
+
+
+def test_default_bucket_stays_within_teamleader_limit(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: clock[0])
+    bucket = TokenBucket()
+
+    calls = []
+    while clock[0] < 1030:
+        if bucket.try_acquire() == 0:
+            calls.append(clock[0])
+        else:
+            clock[0] += 0.01
+
+    assert max(len([t for t in calls if start <= t < start + 5]) for start in calls) <= 25
@@ -0,0 +1,112 @@
+import datetime
+import threading
+
+from stubs import stub_client
+from teamleader.reconcile import Reconciler, Snapshot, diff
+
+
+def test_diff():
+    current = {'forename': 'John', 'email': 'john@example.com', 'tags': ['a', 'b'], 'custom_fields': {'1': 'x', '2': 'y'}}
+    desired = {'id': 1, 'forename': 'John', 'email': 'doe@example.com', 'tags': ['b', 'c'], 'custom_fields': {1: 'x', 2: 'z'}}
+
+    assert diff(current, desired) == {
+        'email': 'doe@example.com',
+        'tags': ['c'],
+        'del_tags': ['a'],
+        'custom_fields': {2: 'z'},
+    }
+    assert diff(current, {'id': 1, 'forename': 'John', 'tags': ['a', 'b']}) == {}
+
+
+def test_reconcile_updates_changed_records(tmpdir):
+    snapshot = Snapshot(str(tmpdir.join('snapshot.json')))
+    snapshot.set(1, {'forename': 'John', 'tags': ['a']})
+    snapshot.set(2, {'forename': 'Jane', 'tags': ['a']})
+    api, transport = stub_client()
+
+    results = list(Reconciler(api, snapshot).reconcile([
+        {'id': 1, 'forename': 'John', 'tags': ['a']},
+        {'id': 2, 'forename': 'Janet', 'tags': ['b'], 'custom_fields': {3: 'x'}},
+    ]))
+
+    changes = {'forename': 'Janet', 'tags': ['b'], 'del_tags': ['a'], 'custom_fields': {3: 'x'}}
+    assert results == [(1, {}), (2, changes)]
+    assert transport.endpoints() == ['updateContact']
+    assert transport.posts[0][1]['contact_id'] == 2
+
+    snapshot.save()
+    assert Snapshot(snapshot.path).get(2) == {'forename': 'Janet', 'tags': ['b'], 'custom_fields': {'3': 'x'}}
+
+
+def test_reconcile_through_client():
+    api, transport = stub_client()
+    snapshot = Snapshot()
+    snapshot.set(1, {'forename': 'John', 'tags': ['a']})
+    snapshot.set(2, {'name': 'Acme', 'tags': ['a']})
+
+    list(Reconciler(api, snapshot).reconcile([{'id': 1, 'forename': 'Jim'}]))
+    list(Reconciler(api, snapshot).reconcile([{'id': 1, 'forename': 'Jim', 'tags': ['a', 'b']}]))
+    list(Reconciler(api, snapshot, 'companies').reconcile([
+        {'id': 2, 'tags': [], 'custom_fields': {3: 'x'}},
+    ]))
+
+    assert transport.endpoints() == ['updateContact', 'updateContact', 'updateCompany']
+    assert transport.posts[0][1]['forename'] == 'Jim'
+    assert transport.posts[1][1]['add_tag_by_string'] == 'b'
+    assert 'forename' not in transport.posts[1][1]
+    assert transport.posts[2][1]['remove_tag_by_string'] == 'a'
+    assert transport.posts[2][1]['custom_field_3'] == 'x'
+
+
+def test_snapshot_dates_and_saving(tmpdir):
+    path = str(tmpdir.join('snapshot.json'))
+    snapshot = Snapshot(path)
+    api, transport = stub_client()
+
+    desired = {'id': 1, 'date_of_birth': datetime.date(1980, 1, 2)}
+    assert list(Reconciler(api, snapshot).reconcile([desired])) == [(1, {'date_of_birth': datetime.date(1980, 1, 2)})]
+    assert list(Reconciler(api, Snapshot(path)).reconcile([desired])) == [(1, {})]
+    assert transport.endpoints() == ['updateContact']
+
+    Snapshot().save()
+
+
+def test_snapshot_load():
+    class ScanAPI(object):
+        def get_companies(self, selected_customfields=None):
+            return iter([{'id': 1, 'name': 'Acme', 'tags': 'a, b', 'cf_value_3': 'x'}])
+
+    snapshot = Snapshot()
+    snapshot.load(ScanAPI(), 'companies', [3])
+
+    assert snapshot.get(1) == {'name': 'Acme', 'tags': ['a', 'b'], 'custom_fields': {'3': 'x'}}
+
+
+def test_dry_run_leaves_snapshot_untouched(tmpdir):
+    path = str(tmpdir.join('snapshot.json'))
+    snapshot = Snapshot(path)
+    snapshot.set(1, {'forename': 'A'})
+    snapshot.save()
+
+    dry_api, _ = stub_client(dry_run=True)
+    assert list(Reconciler(dry_api, Snapshot(path)).reconcile([{'id': 1, 'forename': 'B'}])) == [(1, {'forename': 'B'})]
+    assert dry_api.planner.summary()['endpoints'] == {'updateContact': 1}
+    assert Snapshot(path).get(1) == {'forename': 'A'}
+
+    api, transport = stub_client()
+    list(Reconciler(api, Snapshot(path)).reconcile([{'id': 1, 'forename': 'B'}]))
+    assert transport.endpoints() == ['updateContact']
+
+
+def test_concurrent_saves(tmpdir):
+    snapshot = Snapshot(str(tmpdir.join('snapshot.json')))
+    for i in range(200):
+        snapshot.set(i, {'forename': str(i)})
+
+    threads = [threading.Thread(target=snapshot.save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(Snapshot(snapshot.path).records) == 200
@@ -0,0 +1,53 @@
+import gzip
+import json
+
+import pytest
+
+from teamleader.api import Teamleader, amount
+from teamleader.exceptions import TeamleaderError
+from teamleader.replay import RecordingTransport, ReplayResponse, ReplayTransport
+
+
+class FakeTransport(object):
+
+    def post(self, url, data=None, timeout=None):
+        if url.endswith('updateCompany.php'):
+            return ReplayResponse(200, 'null')
+        if url.endswith('getUsers.php'):
+            return ReplayResponse(200, json.dumps([{'id': 1, 'name': 'John'}]))
+        contacts = [{'id': i} for i in range(amount)] if data['pageno'] == 0 else []
+        return ReplayResponse(200, json.dumps(contacts))
+
+
+def test_record_and_replay(tmpdir):
+    path = str(tmpdir.join('recording.jsonl.gz'))
+
+    with RecordingTransport(path, FakeTransport()) as recorder:
+        api = Teamleader('group', 'secret', transport=recorder)
+        users = api.get_users()
+        contacts = list(api.get_contacts())
+
+    with gzip.open(path, 'rb') as f:
+        recording = f.read().decode('utf-8')
+    assert 'secret' not in recording
+    assert 'group' not in recording
+
+    replay = ReplayTransport(path, latency_scale=0)
+    api = Teamleader('other group', 'other secret', transport=replay)
+    assert api.get_users() == users
+    assert list(api.get_contacts()) == contacts
+    assert replay.requests == 3
+
+    with pytest.raises(TeamleaderError):
+        api.get_departments()
+
+
+def test_record_and_replay_write(tmpdir):
+    path = str(tmpdir.join('recording.jsonl.gz'))
+
+    with RecordingTransport(path, FakeTransport()) as recorder:
+        Teamleader('group', 'secret', transport=recorder).update_company(2, name='Acme', tags=['a'])
+
+    replay = ReplayTransport(path, latency_scale=0)
+    Teamleader('group', 'secret', transport=replay).update_company(2, name='Acme', tags=['a'])
+    assert replay.requests == 1
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from teamleader.api import Teamleader
+from teamleader.exceptions import InvalidInputError
+from teamleader.ratelimit import TokenBucket
+from teamleader.scheduler import PriorityScheduler
+
+
+def test_interactive_requests_jump_the_queue():
+    scheduler = PriorityScheduler(TokenBucket(rate=20, capacity=1), reserves={})
+    scheduler.acquire('batch')
+
+    order = []
+
+    def request(priority):
+        scheduler.acquire(priority)
+        order.append(priority)
+
+    threads = [threading.Thread(target=request, args=('batch',)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.01)
+
+    interactive = threading.Thread(target=request, args=('interactive',))
+    interactive.start()
+    for thread in threads + [interactive]:
+        thread.join()
+
+    assert order.index('interactive') <= 1
+
+    stats = scheduler.stats()
+    assert stats['batch']['requests'] == 4
+    assert stats['batch']['max_queue_depth'] >= 2
+    assert stats['interactive']['queue_depth'] == 0
+
+
+def test_batch_requests_leave_reserve():
+    scheduler = PriorityScheduler(TokenBucket(rate=1, capacity=3), reserves={'batch': 2})
+
+    scheduler.acquire('batch')
+    assert scheduler.rate_limiter.try_acquire(reserve=2) > 0
+    scheduler.acquire('interactive')
+    scheduler.acquire('interactive')
+
+
+def test_teamleader_priority_must_be_known():
+    with pytest.raises(InvalidInputError):
+        Teamleader('group', 'secret', scheduler=PriorityScheduler(), priority='unknown')
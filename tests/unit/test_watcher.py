@@ -0,0 +1,89 @@
+import threading
+
+import requests
+
+from teamleader.exceptions import TeamleaderRateLimitExceededError
+from teamleader.watcher import ChangeEvent, ChangeWatcher
+
+
+class FakeAPI(object):
+
+    def __init__(self, *polls):
+        self.polls = list(polls)
+        self.calls = []
+
+    def get_contacts(self, modified_since=None):
+        self.calls.append(modified_since)
+        poll = self.polls.pop(0)
+        if isinstance(poll, Exception):
+            raise poll
+        return iter(poll)
+
+
+def test_poll_emits_created_and_updated(tmpdir):
+    api = FakeAPI([{'id': 1}], [{'id': 1, 'name': 'John'}, {'id': 2}], [])
+    events = []
+    state_path = str(tmpdir.join('state.json'))
+    watcher = ChangeWatcher(api, callbacks=[events.append], state_path=state_path, overlap=0)
+
+    assert watcher.poll() == 1
+    assert watcher.poll() == 2
+    assert watcher.poll() == 0
+
+    assert events == [
+        ChangeEvent('created', 'contacts', {'id': 1}),
+        ChangeEvent('updated', 'contacts', {'id': 1, 'name': 'John'}),
+        ChangeEvent('created', 'contacts', {'id': 2}),
+    ]
+    assert api.calls[0] is None
+    assert api.calls[2] <= watcher.modified_since
+
+    restarted = ChangeWatcher(api, state_path=state_path)
+    assert restarted.known_ids == {1, 2}
+    assert restarted.modified_since == watcher.modified_since
+
+
+def test_interval_adapts_to_changes():
+    api = FakeAPI([{'id': 1}], [], [], [{'id': 2}])
+    watcher = ChangeWatcher(api, min_interval=1, max_interval=4, backoff=2)
+
+    intervals = []
+    for _ in range(4):
+        watcher.poll()
+        intervals.append(watcher.interval)
+
+    assert intervals == [1, 2, 4, 2]
+
+
+def test_overlap_does_not_repeat_unchanged_records():
+    api = FakeAPI([{'id': 1, 'name': 'a'}], [{'id': 1, 'name': 'a'}], [{'id': 1, 'name': 'b'}])
+    events = []
+    watcher = ChangeWatcher(api, callbacks=[events.append], min_interval=1, max_interval=4, backoff=2)
+
+    assert watcher.poll() == 1
+    assert watcher.poll() == 0
+    assert watcher.interval == 2
+    assert watcher.poll() == 1
+
+    assert [event.type for event in events] == ['created', 'updated']
+
+
+def test_run_keeps_polling_after_transient_errors():
+    api = FakeAPI(TeamleaderRateLimitExceededError("limit", None),
+                  requests.exceptions.ConnectionError(), [{'id': 1}])
+    events = []
+    watcher = ChangeWatcher(api, callbacks=[events.append], min_interval=1, max_interval=4, backoff=2)
+
+    stop = threading.Event()
+    intervals = []
+
+    def wait(timeout):
+        intervals.append(timeout)
+        if not api.polls:
+            stop.set()
+
+    stop.wait = wait
+    watcher.run(stop)
+
+    assert intervals == [2, 4, 2]
+    assert [event.record for event in events] == [{'id': 1}]